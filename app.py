@@ -1,11 +1,12 @@
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
-from google.cloud import storage
-from langchain_core.prompts import PromptTemplate
-from langchain_classic.chains import LLMChain
-from langchain_google_genai import GoogleGenerativeAI
+import io
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import json
 import os
+import re
 
 # ====================== PAGE CONFIG ======================
 st.set_page_config(page_title="Campus Resource Share", page_icon="📚", layout="centered")
@@ -21,67 +22,210 @@ st.sidebar.caption("Powered by Google Firebase • Cloud Storage • Gemini AI")
 
 
 
-# Safe Firebase initialization (handles Streamlit reruns perfectly)
-try:
-    firebase_admin.get_app()
-except ValueError:
-    cred = credentials.Certificate("firebase_key.json")
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()
 # === Google Cloud Storage ===
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "firebase_key.json"
-storage_client = storage.Client()
 bucket_name = "campus-resource-share-code"  # ← CHANGE THIS TO YOUR EXACT BUCKET NAME IF DIFFERENT
-bucket = storage_client.bucket(bucket_name)
 
-# === Gemini AI Key (Secure way using Streamlit secrets) ===
-# Create a folder .streamlit in your project, then file secrets.toml inside it:
-# GEMINI_API_KEY = "your_actual_key_here"
-try:
-    GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
-except:
-    st.error("⚠️ Please add your Gemini API key to .streamlit/secrets.toml")
-    st.stop()
+# Clients, credentials and the Gemini key are set up once per process and shared across reruns and sessions
+@st.cache_resource
+def _init():
+    # Heavy client libraries are imported here so only the first run pays for them
+    from google.cloud import storage
+    from langchain_core.globals import set_llm_cache
+    from langchain_community.cache import SQLiteCache
+    from langchain_google_genai import GoogleGenerativeAI
+
+    # === Gemini AI Key (Secure way using Streamlit secrets) ===
+    # Create a folder .streamlit in your project, then file secrets.toml inside it:
+    # GEMINI_API_KEY = "your_actual_key_here"
+    try:
+        gemini_api_key = st.secrets["GEMINI_API_KEY"]
+    except (KeyError, FileNotFoundError):
+        st.error("⚠️ Please add your Gemini API key to .streamlit/secrets.toml")
+        st.stop()
+
+    # Safe Firebase initialization (handles Streamlit reruns perfectly)
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        try:
+            cred = credentials.Certificate("firebase_key.json")
+        except FileNotFoundError:
+            st.error("⚠️ Please add your Firebase service account key as firebase_key.json")
+            st.stop()
+        firebase_admin.initialize_app(cred)
+
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "firebase_key.json"
+    storage_client = storage.Client()
+
+    # Repeated postings (re-submits, demos) are answered from disk instead of calling Gemini again
+    set_llm_cache(SQLiteCache(database_path=".langchain.db"))
+
+    return (
+        firestore.client(),
+        storage_client.bucket(bucket_name),
+        GoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=gemini_api_key),
+    )
+
+db, bucket, llm = _init()
+
+# GCS resumable uploads need a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
-llm = GoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=GEMINI_API_KEY)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Cards render images at 300px, so a 600px thumbnail stays sharp on high-DPI screens
+THUMBNAIL_WIDTH = 600
+
+def upload_thumbnail(image_bytes, thumb_path):
+    # Runs on the executor; returns False if Pillow can't read the image so the post goes ahead without one
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # Phone photos store their rotation in EXIF, which is dropped when re-encoding
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((THUMBNAIL_WIDTH, image.height))
+        thumbnail = io.BytesIO()
+        image.convert("RGB").save(thumbnail, format="JPEG", quality=85)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        # Unrecognised, truncated/corrupt or oversized images
+        return False
+    thumbnail.seek(0)
+    bucket.blob(thumb_path).upload_from_file(thumbnail, content_type="image/jpeg")
+    return True
+
+# V4 signed URLs are valid for at most 7 days; the cached URL is refreshed well before it expires
+SIGNED_URL_EXPIRATION = timedelta(days=7)
+
+@st.cache_data(ttl=timedelta(days=1), show_spinner=False)
+def get_signed_url(blob_name):
+    return bucket.blob(blob_name).generate_signed_url(
+        version="v4",
+        expiration=SIGNED_URL_EXPIRATION,
+        method="GET"
+    )
 
 # ====================== AI AGENTS ======================
-stitch_prompt = PromptTemplate(
-    input_variables=["data"],
-    template="""Clean and standardize this resource posting for better matching. 
-Remove typos, format consistently, extract key details.
+# Safety review and recommendations in one Gemini call; a cleaned copy of the posting is not
+# requested since nothing reads it
+review_prompt = """You review resource postings for a campus sharing platform.
 Input: {data}
-Output only the cleaned version:"""
-)
-stitch_agent = LLMChain(llm=llm, prompt=stitch_prompt)
-
-antigravity_prompt = PromptTemplate(
-    input_variables=["data"],
-    template="""Scan this resource posting for safety or privacy risks (personal info, inappropriate content, etc.): {data}
-Respond with: APPROVED or REJECTED followed by a brief reason."""
-)
-antigravity_agent = LLMChain(llm=llm, prompt=antigravity_prompt)
-
-gemini_prompt = PromptTemplate(
-    input_variables=["query"],
-    template="""Based on this resource: {query}
+
+1. Scan it for safety or privacy risks (personal info, inappropriate content, etc.).
+2. Suggest 3 similar resources a student might also need (books, notes, equipment), as a numbered list.
+
+Respond with only a JSON object with these keys:
+{{"verdict": "APPROVED or REJECTED", "reason": "<brief reason>", "recommendations": "<numbered list>"}}"""
+
+# Short, plain postings with nothing the prefilter flags only need recommendations
+recommendation_prompt = """Based on this resource: {data}
 Suggest 3 similar resources a student might also need (books, notes, equipment).
 Format as a numbered list."""
-)
-gemini_agent = LLMChain(llm=llm, prompt=gemini_prompt)
+
+_PII_RE = re.compile(r"(\b\d{10}\b|\S+@\S+|https?://)")
+_BLOCKED_WORDS_RE = re.compile(r"\b(sex|nude|drugs?|weed|alcohol|weapons?|guns?)\b", re.IGNORECASE)
+REVIEW_DESCRIPTION_LENGTH = 400
+
+def needs_review(resource_data):
+    text = f"{resource_data['title']} {resource_data['description']}"
+    return (
+        len(resource_data["description"]) >= REVIEW_DESCRIPTION_LENGTH
+        or not text.isascii()
+        or _PII_RE.search(text) is not None
+        or _BLOCKED_WORDS_RE.search(text) is not None
+    )
+
+def parse_review(reply):
+    # Gemini sometimes wraps JSON in a ```json fence
+    reply = reply.strip().removeprefix("```json").removeprefix("```").removesuffix("```")
+    return json.loads(reply)
 
 def process_resource_with_agents(resource_data):
     try:
-        cleaned = stitch_agent.run(str(resource_data))
-        safety = antigravity_agent.run(cleaned)
-        if "rejected" in safety.lower():
-            return f"❌ Rejected: {safety}"
-        recommendations = gemini_agent.run(cleaned)
-        return f"✅ Approved!\n\n**AI Recommendations:**\n{recommendations}"
+        # Only the stable, user-written fields go to Gemini: signed URLs and tokens would defeat the
+        # LLM cache and leak download links
+        summary = f"{resource_data['title']} ({resource_data['category']}): {resource_data['description']}"
+        if not needs_review(resource_data):
+            recommendations = llm.invoke(recommendation_prompt.format(data=summary))
+            return f"✅ Approved!\n\n**AI Recommendations:**\n{recommendations}"
+        review = parse_review(llm.invoke(review_prompt.format(data=summary)))
+        if "REJECTED" in review["verdict"].upper():
+            return f"❌ Rejected: {review['reason']}"
+        return f"✅ Approved!\n\n**AI Recommendations:**\n{review['recommendations']}"
     except Exception as e:
         return f"⚠️ Agent error: {str(e)}"
 
+# ====================== RESOURCE QUERIES ======================
+_TOKEN_RE = re.compile(r"\w{3,}")
+
+def build_search_tokens(text):
+    # Lowercase words of 3+ chars, stored on each resource so search runs as an indexed array_contains
+    return sorted({w.lower() for w in _TOKEN_RE.findall(text)})
+
+# Resources posted before search tokens existed are invisible to search until they get them. This runs
+# once per process, and the marker document makes every run after the first a single read.
+@st.cache_resource(show_spinner=False)
+def backfill_search_tokens():
+    marker = db.collection("meta").document("migrations")
+    if (marker.get().to_dict() or {}).get("search_tokens"):
+        return
+    batch = db.batch()
+    pending = 0
+    for doc in db.collection("resources").select(["title", "description", "category", "search_tokens"]).stream():
+        data = doc.to_dict()
+        if "search_tokens" in data:
+            continue
+        text = f"{data.get('title', '')} {data.get('description', '')} {data.get('category', '')}"
+        batch.update(doc.reference, {"search_tokens": build_search_tokens(text)})
+        pending += 1
+        if pending == 500:  # Firestore's limit on writes per batch
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    marker.set({"search_tokens": True}, merge=True)
+
+# The Python SDK's stream() has no page_size: each query is one server-streaming RPC, so the only
+# extra round trips are Load more clicks, and each page costs at most PAGE_SIZE reads
+PAGE_SIZE = 20
+# Only the fields a resource card renders (plus timestamp for the page cursor)
+LISTING_FIELDS = ["title", "description", "category", "owner", "file_url", "file_path", "thumb_path", "timestamp"]
+
+# Cached so that reruns (every keystroke in the search box) don't hit Firestore again.
+# Sorting is served by the composite indexes in firestore.indexes.json (firebase deploy --only firestore:indexes).
+# Pages are keyed by the (timestamp, doc id) of the previous page's last resource, the id breaking ties between
+# equal timestamps (never .offset(), which bills skipped reads)
+@st.cache_data(ttl=30, show_spinner=False)
+def load_available_resources(search_term="", cursor=None):
+    query = db.collection("resources").where("status", "==", "available")
+    if search_term:
+        query = query.where("search_tokens", "array_contains", search_term)
+    query = (
+        query.select(LISTING_FIELDS)
+        .order_by("timestamp", direction=firestore.Query.DESCENDING)
+        .order_by("__name__", direction=firestore.Query.DESCENDING)
+        .limit(PAGE_SIZE)
+    )
+    if cursor is not None:
+        timestamp, doc_id = cursor
+        query = query.start_after({"timestamp": timestamp, "__name__": doc_id})
+    return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+# ====================== RESOURCE WRITES ======================
+def save_resource(resource_data):
+    # The resource and its audit row are committed together in one round trip
+    batch = db.batch()
+    ref = db.collection("resources").document()
+    batch.set(ref, resource_data)
+    batch.set(db.collection("audit").document(), {
+        "action": "post",
+        "user": resource_data["owner"],
+        "ref": ref.id,
+        "ts": firestore.SERVER_TIMESTAMP
+    })
+    batch.commit()
+    return ref
+
 # ====================== AUTHENTICATION (Hackathon Mode) ======================
 if 'user' not in st.session_state:
     st.subheader("🔐 Login / Signup (Demo Mode)")
@@ -122,22 +266,18 @@ if 'user' in st.session_state:
                 st.error("Title and description are required.")
             else:
                 file_url = ""
+                file_path = ""
+                thumb_path = ""
                 if uploaded_file is not None:  # ← Check if file was actually uploaded
-                    with st.spinner("Uploading file..."):
-                        filename = f"{st.session_state.user['email'].split('@')[0]}_{uploaded_file.name}"
-                        blob = bucket.blob(filename)
-                        blob.upload_from_file(uploaded_file)
-                        
-                        # Generate signed URL
-                        signed_url = blob.generate_signed_url(
-                            version="v4",
-                            expiration=timedelta(days=365),
-                            method="GET"
-                        )
-                        file_url = signed_url
-                        st.success("File uploaded securely!")
-                else:
-                    file_url = ""
+                    filename = f"{st.session_state.user['email'].split('@')[0]}_{uploaded_file.name}"
+                    # Signing is done locally, so the URL is ready before the upload finishes.
+                    # The blob name is stored so listings can re-sign it; file_url is kept for older readers
+                    file_path = filename
+                    file_url = get_signed_url(filename)
+
+                    # Listings show a small thumbnail; the full image is only fetched on click
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        thumb_path = f"{os.path.splitext(filename)[0]}_thumb.jpg"
 
                 # Now create resource data (outside if/else)
                 resource_data = {
@@ -146,13 +286,39 @@ if 'user' in st.session_state:
                     "category": category,
                     "owner": st.session_state.user["email"],
                     "file_url": file_url,
+                    "file_path": file_path,
+                    "thumb_path": thumb_path,
                     "status": "available",
                     "timestamp": firestore.SERVER_TIMESTAMP
                 }
+                resource_data["search_tokens"] = build_search_tokens(f"{title} {description} {category}")
 
-                with st.spinner("Processing with AI agents..."):
-                    db.collection("resources").add(resource_data)
-                    ai_result = process_resource_with_agents(resource_data)
+                # The upload and the Firestore write overlap with the AI review; the resource
+                # is only written once its file is safely in the bucket
+                with st.status("Processing with AI agents...") as status:
+                    with ThreadPoolExecutor(max_workers=3) as executor:
+                        ai_future = executor.submit(process_resource_with_agents, resource_data)
+                        if uploaded_file is not None:
+                            status.update(label="Uploading file...")
+                            # Resumable upload in 8 MB chunks, so a dropped connection doesn't restart from zero
+                            blob = bucket.blob(filename, chunk_size=UPLOAD_CHUNK_SIZE)
+                            upload_future = executor.submit(
+                                blob.upload_from_file, uploaded_file, rewind=True, content_type=uploaded_file.type
+                            )
+                            if thumb_path:
+                                # The thumbnail reads its own copy of the bytes, not the file the upload is streaming
+                                thumb_future = executor.submit(upload_thumbnail, uploaded_file.getvalue(), thumb_path)
+                            upload_future.result()
+                            if thumb_path and not thumb_future.result():
+                                resource_data["thumb_path"] = ""
+                            st.write("File uploaded securely!")
+                            status.update(label="Processing with AI agents...")
+                        save_resource(resource_data)
+                        ai_result = ai_future.result()
+                    status.update(label="Done!", state="complete")
+                load_available_resources.clear()
+                # Cursors from the old pages no longer line up with the refetched ones
+                st.session_state.page_cursors = [None]
 
                 st.success("Resource posted successfully!")
                 st.info(ai_result)
@@ -163,14 +329,37 @@ st.subheader(" Search Available Resources")
 
 search_query = st.text_input("Search by title, category, or description")
 
-resources = db.collection("resources").where("status", "==", "available").stream()
+backfill_search_tokens()
+
+# First term is matched by Firestore, any remaining terms are refined here
+search_terms = build_search_tokens(search_query)
+search_terms.sort(key=search_query.lower().find)
+
+search_term = search_terms[0] if search_terms else ""
+
+# Start again from the first page whenever the search changes
+if st.session_state.get("page_search") != search_term:
+    st.session_state.page_search = search_term
+    st.session_state.page_cursors = [None]
+
+if 'requested_ids' not in st.session_state:
+    st.session_state.requested_ids = set()
+
+pages = []
+if search_query and not search_terms:
+    st.info("Search terms need at least 3 characters.")
+else:
+    pages = [load_available_resources(search_term, cursor) for cursor in st.session_state.page_cursors]
+# Pages are cached separately, so a refetched earlier page can overlap a later one; keep each resource once
+resources = list({doc_id: data for page in pages for doc_id, data in page}.items())
 
 found = False
-for doc in resources:
-    data = doc.to_dict()
+for doc_id, data in resources:
+    if doc_id in st.session_state.requested_ids:
+        continue
     search_text = f"{data['title']} {data['description']} {data['category']}".lower()
-    
-    if search_query.lower() in search_text or not search_query:
+
+    if all(term in search_text for term in search_terms[1:]):
         found = True
         with st.container(border=True):
             st.markdown(f"""
@@ -179,17 +368,29 @@ for doc in resources:
 """)
             st.write(data['description'])
 
-            if data.get('file_url'):
-                if data['file_url'].lower().endswith(('.jpg', '.jpeg', '.png')):
-                    st.image(data['file_url'], width=300)
+            file_url = get_signed_url(data['file_path']) if data.get('file_path') else data.get('file_url')
+            if file_url:
+                if data.get('thumb_path'):
+                    st.image(get_signed_url(data['thumb_path']), width=300)
+                    st.markdown(f"[View full size]({file_url})")
+                elif (data.get('file_path') or file_url).lower().endswith(IMAGE_EXTENSIONS):
+                    st.image(file_url, width=300)
                 else:
-                    st.markdown(f"[Download File]({data['file_url']})")
+                    st.markdown(f"[Download File]({file_url})")
 
-            if st.button("Request this Resource", key=doc.id):
-                db.collection("resources").document(doc.id).update({"status": "requested"})
+            if st.button("Request this Resource", key=doc_id):
+                db.collection("resources").document(doc_id).update({"status": "requested"})
+                # Hide it locally rather than clearing the cache, so the rerun doesn't refetch every page
+                st.session_state.requested_ids.add(doc_id)
                 st.success("Request sent!")
                 st.rerun()
 
+if pages and len(pages[-1]) == PAGE_SIZE:
+    if st.button("Load more"):
+        last_id, last_data = pages[-1][-1]
+        st.session_state.page_cursors.append((last_data["timestamp"], last_id))
+        st.rerun()
+
 if not found and search_query:
     st.info("No resources found matching your search.")
 elif not search_query: